@@ -0,0 +1,174 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from pathlib import Path
+
+import FreeCAD
+import numpy as np
+import psutil
+
+from parameters import ParametersDesign
+from geometry import DesignGeometry, cpc_truncation
+from design import single_design, close_document, extract_objects
+from material_library import MATERIALS_DIR, compile_materials, load_materials
+from evaluation import TraceSettings, build_experiment
+import profiling
+
+# Benchmark of the design/trace pipeline on a fixed set of designs. For each
+# stage it records the wall time, the RSS after the stage, the peak RSS of the
+# process so far and the number of live Python objects and FreeCAD documents.
+# The recompute spans of single_design (see profiling.span) are recorded too.
+#
+#   python /dist/benchmark.py --output bench.json [--baseline old.json]
+#
+# With --baseline, the run fails (exit code 1) if the total time of any stage
+# is more than --tolerance times the one in the baseline and at least
+# MIN_REGRESSION_SECONDS longer (so that stages of microseconds are not flagged).
+DEFAULT_SEED = 0
+DEFAULT_DESIGNS = 5
+DEFAULT_RAYS = 100
+DEFAULT_TOLERANCE = 1.5
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def fixed_parameters(n_designs: int = DEFAULT_DESIGNS, seed: int = DEFAULT_SEED) -> list[ParametersDesign]:
+    # The same designs for every run; only feasible designs are kept
+    np.random.seed(seed)
+    parameters = []
+    while len(parameters) < n_designs:
+        p = ParametersDesign.random_parameters()
+        if DesignGeometry.from_parameters(p).feasible:
+            parameters.append(p)
+    return parameters
+
+
+class Benchmark:
+    def __init__(self):
+        self.stages: dict[str, list[dict]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.setdefault(name, []).append({
+                'seconds': time.perf_counter() - start,
+                'rss': psutil.Process().memory_info().rss,
+                # ru_maxrss is in kilobytes on Linux
+                'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                'python_objects': len(gc.get_objects()),
+                'open_documents': len(FreeCAD.listDocuments()),
+            })
+
+    def summary(self) -> dict:
+        return {
+            name: {
+                'calls': len(samples),
+                'total_seconds': sum(sample['seconds'] for sample in samples),
+                'max_seconds': max(sample['seconds'] for sample in samples),
+                'rss': samples[-1]['rss'],
+                'peak_rss': samples[-1]['peak_rss'],
+                'python_objects': samples[-1]['python_objects'],
+                'open_documents': samples[-1]['open_documents'],
+            }
+            for name, samples in self.stages.items()
+        }
+
+
+def run_benchmark(n_designs: int = DEFAULT_DESIGNS, number_of_rays: int = DEFAULT_RAYS,
+                  seed: int = DEFAULT_SEED) -> dict:
+    profiling.enable_profiling()
+    try:
+        with profiling.record_spans() as recorded:
+            return _run_benchmark(n_designs, number_of_rays, seed, recorded)
+    finally:
+        profiling.enable_profiling(False)
+
+
+def _run_benchmark(n_designs: int, number_of_rays: int, seed: int, recorded: dict[str, list[float]]) -> dict:
+    bench = Benchmark()
+
+    with bench.stage('random_parameters'):
+        parameters = fixed_parameters(n_designs, seed)
+
+    for p in parameters:
+        with bench.stage('cpc_phi'):
+            cpc_truncation(p.aperture_cylinder, p.acceptance_angle, p.truncation_factor)
+        with bench.stage('geometry'):
+            DesignGeometry.from_parameters(p)
+
+    compile_materials(MATERIALS_DIR)
+    with bench.stage('materials_json'):
+        load_materials(use_compiled=False)
+    with bench.stage('materials_compiled'):
+        load_materials(use_compiled=True)
+
+    settings = TraceSettings(number_of_rays=number_of_rays)
+    for i, p in enumerate(parameters):
+        with bench.stage('single_design'):
+            doc = single_design(p)
+        objects = extract_objects(doc)
+        with bench.stage('trace'):
+            random.seed(seed + i)
+            np.random.seed(seed + i)
+            build_experiment(objects, settings).run()
+        del objects
+        with bench.stage('close_document'):
+            close_document(doc)
+
+    spans = {name: {'calls': len(times), 'total_seconds': sum(times), 'max_seconds': max(times)}
+             for name, times in recorded.items()}
+    return {
+        'settings': {'n_designs': n_designs, 'number_of_rays': number_of_rays, 'seed': seed},
+        'environment': {'python': sys.version, 'platform': platform.platform(), 'freecad': FreeCAD.Version()},
+        'parameters': [{key: value.item() if isinstance(value, np.generic) else value
+                        for key, value in asdict(p).items()} for p in parameters],
+        'stages': bench.summary(),
+        'spans': spans,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    # Stages whose total time grew more than `tolerance` times with respect to the baseline
+    regressions = []
+    for name, stage in results['stages'].items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]['total_seconds']
+        after = stage['total_seconds']
+        if after > tolerance * before and after - before > MIN_REGRESSION_SECONDS:
+            regressions.append(f'{name}: {before:.4f}s -> {after:.4f}s')
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark of the design/trace pipeline")
+    parser.add_argument('--designs', type=int, default=DEFAULT_DESIGNS)
+    parser.add_argument('--rays', type=int, default=DEFAULT_RAYS)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', type=Path, default=Path('benchmark.json'))
+    parser.add_argument('--baseline', type=Path, default=None)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.designs, args.rays, args.seed)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    for name, stage in results['stages'].items():
+        print(f"{name:20s} {stage['total_seconds']:10.4f}s  peak RSS {stage['peak_rss'] / 2 ** 20:8.1f} MB")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
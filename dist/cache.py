@@ -0,0 +1,238 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+import FreeCAD
+import numpy as np
+
+from parameters import ParametersDesign
+from design import single_design, close_document
+
+# Cache of built designs. With docker compose, it is shared by all the workers
+# through the /notebooks volume (see docker-compose.override.yml); with docker
+# stack each worker container has its own, unless DESIGN_CACHE_DIR points to a
+# filesystem shared by all the nodes with working flock locks (NFS locks are
+# unreliable). Workers use it when TraceSettings.use_design_cache is set.
+# Each entry is a FreeCAD document `<key>.FCStd` plus a `<key>.json` with the
+# parameters it was built from and the time it took to build it.
+DEFAULT_CACHE_DIR = Path(os.environ.get('DESIGN_CACHE_DIR', '/notebooks/design_cache'))
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get('DESIGN_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+LOCK_FILE = '.lock'
+# temporary files older than this are from writers that crashed
+STALE_TEMPORARY_SECONDS = 3600
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    build_seconds: float = 0.0  # time spent building designs on misses
+    load_seconds: float = 0.0  # time spent loading designs on hits
+    saved_seconds: float = 0.0  # build time of the designs served from the cache
+
+    def as_dict(self) -> dict:
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+class DesignCache:
+    """
+    Content-addressed cache of the documents built by `single_design`.
+
+    Entries are keyed by a hash of `ParametersDesign.as_tuple()`. If `decimals`
+    is given, floats are rounded to that many decimals before hashing, and the
+    design is built from the rounded parameters, so that every entry is the
+    design of exactly the parameters it is keyed by.
+
+    Entries are written to a temporary file and renamed, so concurrent readers
+    never see partial files. Writers and eviction are serialized with a lock
+    file. Eviction removes the least recently used entries (by mtime, which is
+    refreshed on every hit) until the cache is below `max_bytes`.
+    """
+
+    def __init__(self, directory: Path | str = DEFAULT_CACHE_DIR,
+                 max_bytes: int = DEFAULT_CACHE_MAX_BYTES, decimals: int | None = None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.decimals = decimals
+        self.stats = CacheStats()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def quantize(self, parameters: ParametersDesign) -> ParametersDesign:
+        if self.decimals is None:
+            return parameters
+        return ParametersDesign.from_tuple(tuple(
+            value if isinstance(value, bool) else round(value, self.decimals)
+            for value in self._canonical_tuple(parameters)
+        ))
+
+    def key(self, parameters: ParametersDesign) -> str:
+        canonical = json.dumps(self._canonical_tuple(self.quantize(parameters)))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def design(self, parameters: ParametersDesign) -> FreeCAD.Document:
+        # Returns the document of the design, building it (and storing it) if it is not cached
+        doc = self.get(parameters)
+        if doc is not None:
+            return doc
+        parameters = self.quantize(parameters)
+        start = time.perf_counter()
+        doc = single_design(parameters)
+        build_seconds = time.perf_counter() - start
+        self.stats.build_seconds += build_seconds
+        try:
+            self.put(parameters, doc, build_seconds)
+        except BaseException:
+            close_document(doc)
+            raise
+        return doc
+
+    def get(self, parameters: ParametersDesign) -> FreeCAD.Document | None:
+        key = self.key(parameters)
+        path = self._document_path(key)
+        start = time.perf_counter()
+        try:
+            with open(self._metadata_path(key)) as f:
+                metadata = json.load(f)
+            # the mtime is refreshed before opening, so that an entry evicted
+            # meanwhile is a miss and no document is left open
+            os.utime(path)
+            # the document is opened from a private copy, so that the entry can be
+            # evicted and the same design can be opened several times
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                tmp_path = os.path.join(tmp_dir, path.name)
+                shutil.copyfile(path, tmp_path)
+                doc = FreeCAD.openDocument(tmp_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.load_seconds += time.perf_counter() - start
+        self.stats.saved_seconds += metadata['build_seconds']
+        return doc
+
+    def put(self, parameters: ParametersDesign, doc: FreeCAD.Document, build_seconds: float):
+        key = self.key(parameters)
+        metadata = {
+            'parameters': self._canonical_tuple(parameters),
+            'build_seconds': build_seconds,
+        }
+        # unique names: workers in different containers may have the same pid
+        tmp_document = self._temporary_path(key, '.tmp.FCStd')
+        tmp_metadata = self._temporary_path(key, '.tmp.json')
+        try:
+            doc.saveAs(str(tmp_document))
+            with open(tmp_metadata, 'w') as f:
+                json.dump(metadata, f)
+            with self._lock():
+                # the document goes first, so that an entry with metadata is always complete
+                os.replace(tmp_document, self._document_path(key))
+                os.replace(tmp_metadata, self._metadata_path(key))
+                self._evict()
+        finally:
+            for path in (tmp_document, tmp_metadata):
+                path.unlink(missing_ok=True)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        with self._lock():
+            for _, _, key in self._entries():
+                self._remove(key)
+
+    def _evict(self):
+        self._remove_stale_temporary_files()
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
+    def _entries(self) -> list[tuple[float, int, str]]:
+        # (mtime, size, key) of the documents in the cache; the temporary files
+        # of writers of other processes are not entries
+        entries = []
+        for path in self.directory.glob('*.FCStd'):
+            if '.tmp' in path.suffixes:
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path.stem))
+        return entries
+
+    def _remove_stale_temporary_files(self):
+        # temporary files left by writers that crashed; they are not entries,
+        # so they would never be evicted
+        now = time.time()
+        for path in self.directory.glob('*.tmp.*'):
+            try:
+                if now - path.stat().st_mtime > STALE_TEMPORARY_SECONDS:
+                    path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _temporary_path(self, key: str, suffix: str) -> Path:
+        fd, path = tempfile.mkstemp(dir=self.directory, prefix=f'{key}.', suffix=suffix)
+        os.close(fd)
+        return Path(path)
+
+    def _remove(self, key: str):
+        for path in (self._metadata_path(key), self._document_path(key)):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _lock(self):
+        with open(self.directory / LOCK_FILE, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _document_path(self, key: str) -> Path:
+        return self.directory / f'{key}.FCStd'
+
+    def _metadata_path(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    @staticmethod
+    def _canonical_tuple(parameters: ParametersDesign) -> list:
+        # plain Python values, so that numpy scalars hash the same as floats and bools
+        return [bool(value) if isinstance(value, (bool, np.bool_)) else float(value)
+                for value in parameters.as_tuple()]
+
+
+_default_cache: DesignCache | None = None
+
+
+def cached_design(parameters: ParametersDesign) -> FreeCAD.Document:
+    # single_design through the default cache of this process
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DesignCache()
+    return _default_cache.design(parameters)
+
+
+def cache_stats() -> dict:
+    if _default_cache is None:
+        return CacheStats().as_dict()
+    return _default_cache.stats.as_dict()
+
+
+def worker_cache_stats(client) -> dict:
+    # cache_stats of every worker, by worker address
+    return client.run(cache_stats)
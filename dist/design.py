@@ -1,75 +1,45 @@
-from dataclasses import dataclass, astuple
+import gc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator
 
 import FreeCAD
 import Part
 # from FreeCAD import App
 from FreeCAD import Base
 import numpy as np
-import math
+import psutil
 from itertools import product
 
-# CONSTANT PARAMETERS
-PRIMARY_FOCUS = 800  # Focal distance of the primary mirror
-PRIMARY_LENGTH = 4900  # Primary mirror length
-APERTURE_WIDTH = 1250  # Total width of the primary mirror
-RECEIVER_DIAMETER = 15  # Outer diameter of the receiver tube
-PRIMARY_GLASS_THICKNESS = 1  #
-SECONDARY_GLASS_THICKNESS = 1  #
-THICKNESS_GLASS_COVER = 4  #
-
-# VARIABLE PARAMETERS
-
-SECONDARY_FOCUS_MIN = 40
-SECONDARY_FOCUS_MAX = 80
-# SECONDARY_FOCUS = np.arange(40, 81, 20)  # Focal distance of the secondary mirror
-HEIGHT_CYLINDER_MIN = 100
-HEIGHT_CYLINDER_MAX = 250
-# HEIGHT_CYLINDER = np.arange(100, 251, 50)  # Height of the integrating cylinder center
-CYLINDER_DIAMETER_MIN = 35
-CYLINDER_DIAMETER_MAX = 60
-# CYLINDER_DIAMETER = np.arange(40, 60.1, 10)  # Diameter of the integrating cylinder
-APERTURE_CYLINDER_MIN = 13.5
-APERTURE_CYLINDER_MAX = 37.5
-# APERTURE_CYLINDER = np.arange(13.5, 37.6, 6)  # Aperture of the integrating cylinder
-ACCEPTANCE_ANGLE_MIN = 20
-ACCEPTANCE_ANGLE_MAX = 60
-# ACCEPTANCE_ANGLE = np.arange(20.0, 60.01, 10)  # Semi-acceptance angle of the CPC mirror
-TRUNCATION_FACTOR_MIN = 0.0
-TRUNCATION_FACTOR_MAX = 1.0
+# constants and ParametersDesign live in parameters.py (no FreeCAD needed) and are re-exported here
+from parameters import *
+from geometry import DesignGeometry
+from profiling import span
 
-@dataclass
-class ParametersDesign:
-    secondary_focus: float
-    height_cylinder: float
-    cylinder_diameter: float
-    aperture_cylinder: float
-    acceptance_angle: float
-    truncation_factor: float
-    cylinder_material: bool
-
-    @classmethod
-    def random_parameters(cls) -> 'ParametersDesign':
-        return ParametersDesign(
-            secondary_focus = np.random.uniform(SECONDARY_FOCUS_MIN, SECONDARY_FOCUS_MAX),
-            height_cylinder = np.random.uniform(HEIGHT_CYLINDER_MIN, HEIGHT_CYLINDER_MAX),
-            cylinder_diameter = np.random.uniform(CYLINDER_DIAMETER_MIN, CYLINDER_DIAMETER_MAX),
-            aperture_cylinder = np.random.uniform(APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX),
-            acceptance_angle = np.random.uniform(ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX),
-            truncation_factor = np.random.uniform(TRUNCATION_FACTOR_MIN, TRUNCATION_FACTOR_MAX),
-            cylinder_material = np.random.choice([True, False])
-        )
-
-    def as_tuple(self) -> tuple:
-        return astuple(self)
+# TRUNCATION_FACTOR = np.arange(0.0, 1.01, 0.25)  # CPC truncation factor
 
+def _recompute(doc: FreeCAD.Document, stage: str):
+    # recompute with a timing span per stage, see profiling.span
+    with span(f'recompute_{stage}'):
+        doc.recompute()
 
-# TRUNCATION_FACTOR = np.arange(0.0, 1.01, 0.25)  # CPC truncation factor
 
 def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
-    # Alias for active Document
+    # the document is owned by the caller, who must close it (see design_document);
+    # if building it fails (e.g. an OCC error on edge-case geometry) it is closed here
     doc = FreeCAD.newDocument()
+    try:
+        _build_design(doc, parameters)
+    except BaseException:
+        close_document(doc)
+        raise
+    return doc
+
 
+def _build_design(doc: FreeCAD.Document, parameters: ParametersDesign):
     p = parameters
+    with span('design_geometry'):
+        g = DesignGeometry.from_parameters(p)
     if p.cylinder_material:
         cylinder_material_label = 'thinfilm_reflective_SiO2_TiO2_SiO2_Ag'
     else:
@@ -79,24 +49,8 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
 
     # first, we determine the secondary_width and mirror_gap
 
-    semiaperture = APERTURE_WIDTH / 2
-    _angle = np.arctan(PRIMARY_FOCUS / semiaperture)
-    # ray deviated due to optical errors
-    s_sun = 4.65 / 2 / 1000
-    s_m = 2.4529 / 2 / 1000
-    s_s = 2 / 1000
-    s_t = 0.2 * np.pi / 180
-    s_a = 2 / 1000
-    sigma = ((2 * s_sun) ** 2 + (2 * s_m) ** 2 + (2 * s_s) ** 2 + (2 * s_t) ** 2 + (2 * s_a) ** 2) ** 0.5
-    _angle = _angle + sigma
-    z_point = np.tan(_angle) * semiaperture
-    secondary_width = 2 * (
-                z_point - (PRIMARY_FOCUS - p.secondary_focus)) * semiaperture / z_point  # width of the secondary mirror
-
-    if secondary_width > 80:
-        secondary_width = 80
-
-    mirror_gap = secondary_width + 20  # Separation space between primary mirror sections
+    secondary_width = g.secondary_width  # width of the secondary mirror
+    mirror_gap = g.mirror_gap  # Separation space between primary mirror sections
 
     # create a Part object that is a Parabola in the XY plane (the parabola is infinite).
     parabola_curve_a = Part.Parabola()
@@ -123,7 +77,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     extruded_parabola_a.Solid = False
     extruded_parabola_a.TaperAngle = 0.0
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'extruded_parabola_a')
 
     doc.addObject('PartDesign::Body', 'Glass_P_A')
     doc.addObject('PartDesign::FeatureBase', 'Clone_A')
@@ -136,7 +90,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     doc.getObject('Pad_A').Profile = doc.getObject('Clone_A')
     doc.getObject('Pad_A').Length = PRIMARY_GLASS_THICKNESS
     doc.getObject('Glass_P_A').Label = "Glass_P_A(SiO2_Malitson)"
-    doc.recompute()
+    _recompute(doc, 'glass_p_a')
 
     # create a Part object that is a Parabola in the XY plane (the parabola is infinite).
     parabola_curve_b = Part.Parabola()
@@ -163,7 +117,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     extruded_parabola_b.Solid = False
     extruded_parabola_b.TaperAngle = 0.0
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'extruded_parabola_b')
 
     doc.addObject('PartDesign::Body', 'Glass_P_B')
     doc.addObject('PartDesign::FeatureBase', 'Clone_B')
@@ -176,7 +130,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     doc.getObject('Pad_B').Profile = doc.getObject('Clone_B')
     doc.getObject('Pad_B').Length = PRIMARY_GLASS_THICKNESS
     doc.getObject('Glass_P_B').Label = "Glass_P_B(SiO2_Malitson)"
-    doc.recompute()
+    _recompute(doc, 'glass_p_b')
 
     #### SECONDARY ####
 
@@ -205,7 +159,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     extruded_parabola_c.Solid = False
     extruded_parabola_c.TaperAngle = 0.0
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'extruded_parabola_c')
 
     doc.addObject('PartDesign::Body', 'Glass_P_C')
     doc.addObject('PartDesign::FeatureBase', 'Clone_C')
@@ -219,7 +173,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     doc.getObject('Pad_C').Length = SECONDARY_GLASS_THICKNESS
     doc.getObject('Pad_C').Reversed = 1
     doc.getObject('Glass_P_C').Label = "Glass_P_C(SiO2_Malitson)"
-    doc.recompute()
+    _recompute(doc, 'glass_p_c')
 
     #### RECEIVER TUBE ####
 
@@ -241,42 +195,20 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     tube_receiver.TaperAngle = 0.0
     tube_receiver.Placement = Base.Placement(Base.Vector(0.0, 0, 0), Base.Rotation(Base.Vector(1.0, 0.0, 0.0), 0.0))
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'tube_receiver')
 
     #### CPC ####
 
-    # Inputs for the CPC
-    a_width = p.aperture_cylinder  # emitter window
-    angle_ = np.arcsin((a_width / 2) / (p.cylinder_diameter / 2))
-    height_absorber = p.height_cylinder + (p.cylinder_diameter / 2) * np.cos(
-        angle_)  # thermal absorber height from the primary mirrors
-    theta_ = p.acceptance_angle * np.pi / 180  # acceptance angle for the CPC in radians
-    # Parameters for geometry determination
-    a = a_width / 2  # half absorber width
-    a_prima = a / math.sin(theta_)  # half absorber width
-    focal_distance_cpc = a * (1 + math.sin(theta_))  # CPC focal distance
-    h_cpc = focal_distance_cpc * math.cos(theta_) / (math.sin(theta_) ** 2)  # CPC height without truncation
-    h_cpc_t = h_cpc * p.truncation_factor  # CPC height truncated
-    h_cpc_aperture = height_absorber - h_cpc_t  # height of the CPC aperture from primary mirrors
-    b = a / math.tan(theta_)  # Intersection between acceptance lines
-
-    # Algortihm to find the phi angle coordinates according to the CPC truncation.
-    # The phi angle is the aperture angle of the truncated CPC.
-    for phi_ in np.arange(theta_, np.pi, 1E-6):
-        hi = focal_distance_cpc * math.cos(phi_ - theta_) / (math.sin(phi_ / 2) ** 2)
-        if (hi < h_cpc_t):
-            break
-
-    a_cpc_t = focal_distance_cpc * math.sin(phi_ - theta_) / (
-        (math.sin(phi_ / 2) ** 2)) - a  # half CPC truncated aperture
-
-    # m and n parameters for the CPC parabolas
-    n = 2 * a * math.cos(theta_)
-    m = (a + a_cpc_t) * math.sin(phi_) / math.sin(phi_ - theta_)
+    # Inputs for the CPC, see geometry.DesignGeometry
+    height_absorber = g.height_absorber  # thermal absorber height from the primary mirrors
+    theta_ = g.theta  # acceptance angle for the CPC in radians
+    focal_distance_cpc = g.focal_distance_cpc  # CPC focal distance
+    m = g.m  # m and n parameters for the CPC parabolas
+    n = g.n
 
     # --------------------------------------- CPC ------------------------------------------------------
-    x_pos = a - focal_distance_cpc * math.sin(theta_)  # X placement parabola for CPC
-    y_pos = focal_distance_cpc * math.cos(theta_)  # Y placement parabola for CPC
+    x_pos = g.x_pos  # X placement parabola for CPC
+    y_pos = g.y_pos  # Y placement parabola for CPC
     # Create parabola CPC
     parab_cpc = Part.Parabola()
     # define de Focal distance in the X axe
@@ -306,7 +238,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     extruded_parabola_cpc_a.Solid = (False)
     extruded_parabola_cpc_a.TaperAngle = (0.0)
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'extruded_parabola_cpc_a')
 
     # we create the other side of the CPC
     half_parab_cpc.rotate(Base.Vector(0, 0, 0), Base.Vector(0, 0, 1), 180)
@@ -324,17 +256,16 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     extruded_parabola_cpc_b.Solid = (False)
     extruded_parabola_cpc_b.TaperAngle = (0.0)
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'extruded_parabola_cpc_b')
 
     #### CYLINDER ####
 
     # create a generic circle for the CYLINDER
 
-    v1 = Base.Vector(parabola_cpc_a.Shape.BoundBox.XMax, parabola_cpc_a.Shape.BoundBox.YMin,
-                     parabola_cpc_a.Shape.BoundBox.ZMin)
-    v2 = Base.Vector(parabola_cpc_b.Shape.BoundBox.XMin, parabola_cpc_b.Shape.BoundBox.YMin,
-                     parabola_cpc_b.Shape.BoundBox.ZMin)
-    v3 = Base.Vector(0, parabola_cpc_b.Shape.BoundBox.YMin, p.height_cylinder - p.cylinder_diameter / 2.0)
+    # the arc joins the lower ends of both CPC parabolas through the bottom of the cylinder
+    v1 = Base.Vector(-g.cylinder_arc_x, 0, g.cylinder_arc_z)
+    v2 = Base.Vector(g.cylinder_arc_x, 0, g.cylinder_arc_z)
+    v3 = Base.Vector(0, 0, g.cylinder_arc_bottom_z)
 
     # Crear un arco usando los tres puntos
     arc = Part.Arc(v1, v3, v2)
@@ -356,20 +287,18 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     cylinder.TaperAngle = (0.0)
     cylinder.Placement = Base.Placement(Base.Vector(0.0, 0, 0), Base.Rotation(Base.Vector(1.0, 0.0, 0.0), 0.0))
     # to recalculate the whole document
-    FreeCAD.ActiveDocument.recompute()
+    _recompute(doc, 'cylinder')
 
     #### COVER GLASS ####
 
-    v1 = Base.Vector(parabola_cpc_a.Shape.BoundBox.XMin, parabola_cpc_a.Shape.BoundBox.YMax,
-                     parabola_cpc_a.Shape.BoundBox.ZMax)
-    v2 = Base.Vector(parabola_cpc_b.Shape.BoundBox.XMax, parabola_cpc_b.Shape.BoundBox.YMax,
-                     parabola_cpc_b.Shape.BoundBox.ZMax)
+    # the glass covers the upper ends of both CPC parabolas
+    v1 = Base.Vector(g.glass_x, 0, g.glass_z)
 
-    glass = FreeCAD.ActiveDocument.addObject("Part::Box", "glass")
+    glass = doc.addObject("Part::Box", "glass")
     glass.Label = "glass(BK7_Schott)"
     glass.Placement = Base.Placement(v1, Base.Rotation(Base.Vector(1.0, 0.0, 0.0), 0.0))
     glass.Height = THICKNESS_GLASS_COVER
-    glass.Length = parabola_cpc_b.Shape.BoundBox.XMax - parabola_cpc_a.Shape.BoundBox.XMin
+    glass.Length = g.glass_length
     glass.Width = PRIMARY_LENGTH
 
     #### Anti-Reflective layers ####
@@ -383,7 +312,7 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
 
     # print('Aperture area = ', PRIMARY_LENGHT * APERTURE_WIDTH, 'mm2') # 6125000
 
-    doc.recompute()
+    _recompute(doc, 'glass')
     # a = list(arg)
     # # b = round(a[5], 2)
     # # a[5] = b
@@ -394,10 +323,62 @@ def single_design(parameters: ParametersDesign) -> FreeCAD.Document:
     #     Label_drawing = "designs_set_1/design_{0}".format(a)+".FCStd"
     #     doc.saveAs(Label_drawing)
 
-    return doc
-
 
 def random_design() -> tuple[FreeCAD.Document, ParametersDesign]:
     parameters = ParametersDesign.random_parameters()
     return single_design(parameters), parameters
 
+
+
+@contextmanager
+def design_document(parameters: ParametersDesign,
+                    build: Callable[[ParametersDesign], FreeCAD.Document] = single_design
+                    ) -> Iterator[FreeCAD.Document]:
+    # Builds the document of the design and closes it on exit, even on errors.
+    # `build` can be replaced, e.g. by cache.cached_design.
+    with span('design_build'):
+        doc = build(parameters)
+    try:
+        yield doc
+    finally:
+        close_document(doc)
+
+
+def close_document(doc: FreeCAD.Document):
+    with span('design_close'):
+        FreeCAD.closeDocument(doc.Name)
+        # release the OCC shapes still referenced by Python wrappers
+        gc.collect()
+
+
+@dataclass
+class DesignObject:
+    # The part of a document object used by otsun.Scene: a label with the material and a shape
+    Label: str
+    Shape: Part.Shape
+
+
+def extract_objects(doc: FreeCAD.Document) -> list[DesignObject]:
+    # Objects with a material in their label, as "name(material)"; the rest are ignored by otsun
+    return [DesignObject(obj.Label, obj.Shape) for obj in doc.Objects
+            if '(' in obj.Label and ')' in obj.Label]
+
+
+def design_objects(parameters: ParametersDesign,
+                   build: Callable[[ParametersDesign], FreeCAD.Document] = single_design
+                   ) -> list[DesignObject]:
+    # Objects of the design, to be passed to otsun.Scene, without keeping the document open
+    with design_document(parameters, build) as doc:
+        return extract_objects(doc)
+
+
+def memory_report() -> dict:
+    return {
+        'rss': psutil.Process().memory_info().rss,
+        'open_documents': len(FreeCAD.listDocuments()),
+    }
+
+
+def worker_memory_reports(client) -> dict:
+    # memory_report of every Dask worker, keyed by worker address
+    return client.run(memory_report)
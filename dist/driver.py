@@ -0,0 +1,265 @@
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field, replace
+from typing import Callable
+
+import numpy as np
+import optuna
+from distributed import Client, Future, as_completed
+from distributed.comm.core import CommClosedError
+from distributed.scheduler import KilledWorker
+from optuna.trial import TrialState
+
+from parameters import (
+    SECONDARY_FOCUS_MIN, SECONDARY_FOCUS_MAX, HEIGHT_CYLINDER_MIN, HEIGHT_CYLINDER_MAX,
+    CYLINDER_DIAMETER_MIN, CYLINDER_DIAMETER_MAX, APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX,
+    ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX, TRUNCATION_FACTOR_MIN, TRUNCATION_FACTOR_MAX,
+    ParametersDesign,
+)
+from geometry import DesignGeometry
+from tracing import TraceSettings, TraceResult, combine_results
+
+# Errors meaning that the worker running a trial was lost, not that the trial failed
+WORKER_LOST_ERRORS = (KilledWorker, CommClosedError)
+DEFAULT_RETRIES = 2
+
+
+def suggest_parameters(trial: optuna.Trial) -> ParametersDesign:
+    # Same bounds as ParametersDesign.random_parameters
+    return ParametersDesign(
+        secondary_focus=trial.suggest_float('secondary_focus', SECONDARY_FOCUS_MIN, SECONDARY_FOCUS_MAX),
+        height_cylinder=trial.suggest_float('height_cylinder', HEIGHT_CYLINDER_MIN, HEIGHT_CYLINDER_MAX),
+        cylinder_diameter=trial.suggest_float('cylinder_diameter', CYLINDER_DIAMETER_MIN, CYLINDER_DIAMETER_MAX),
+        aperture_cylinder=trial.suggest_float('aperture_cylinder', APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX),
+        acceptance_angle=trial.suggest_float('acceptance_angle', ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX),
+        truncation_factor=trial.suggest_float('truncation_factor', TRUNCATION_FACTOR_MIN, TRUNCATION_FACTOR_MAX),
+        cylinder_material=trial.suggest_categorical('cylinder_material', [True, False]),
+    )
+
+
+def trace_design(*args, **kwargs) -> TraceResult:
+    # evaluation.trace_design, imported where the task runs: evaluation needs FreeCAD
+    # and otsun, which the driver itself does not
+    from evaluation import trace_design
+    return trace_design(*args, **kwargs)
+
+
+def task_seed(trial_number: int, chunk: int) -> int:
+    # Seed of the chunk-th task of a trial: independent for every (trial, chunk),
+    # for any number of trials, and below 2 ** 32 as np.random.seed requires
+    return int(np.random.SeedSequence((trial_number, chunk)).generate_state(1)[0])
+
+
+@dataclass
+class _TrialRun:
+    # State of a trial while its tasks are running
+    trial: optuna.Trial
+    parameters: ParametersDesign
+    started_at: float
+    rung: int = 0
+    next_chunk: int = 0
+    attempts: int = 1
+    result: TraceResult | None = None
+    futures: set = field(default_factory=set)
+    queued: int = 0  # tasks waiting for a free slot
+    finished: bool = False
+
+
+class StudyDriver:
+    """
+    Runs the trials of an Optuna study in a Dask cluster with the ask/tell
+    interface. The objective is the thermal efficiency, so the study must be
+    created with direction='maximize'.
+
+    At most `max_in_flight` tasks (by default, one per worker) are submitted
+    at a time; new trials are asked for when there is a free slot and no task
+    is waiting for one. Each result is told to the study as soon as it
+    arrives, so that no worker waits for the slowest trial of a batch. Tasks
+    whose worker is lost are resubmitted up to `retries` times. Infeasible
+    designs are told a value of 0 without being submitted.
+
+    `fidelities` is an increasing list of total numbers of rays (by default,
+    just `settings.number_of_rays`). A trial is first traced with the first of
+    them; its efficiency is reported to the study, with the number of rays as
+    step, and the pruner of the study may stop it. Otherwise more rays are
+    traced, with new seeds, up to the next fidelity and merged with the
+    previous ones. Each increment is split in tasks of at most
+    `max_rays_per_task` rays, which wait for free slots; tasks of higher
+    fidelities go first.
+
+    SuccessiveHalvingPruner and HyperbandPruner only prune at the steps
+    min_resource * reduction_factor ** k, so with them the fidelities must
+    follow that progression, e.g. [100, 400, 1600] with min_resource=100 and
+    the default reduction_factor=4; with [100, 300, 800] every prune would
+    happen at 100 rays.
+
+    Each trial gets the user attrs `feasible`, `rays`, `efficiency_th_std_error`, `attempts`,
+    `wall_seconds` (from the first submission to the last result),
+    `worker_seconds` and the timings of `trace_design` added over its tasks.
+    `worker_seconds` of the whole run is kept in the attribute of the same
+    name, to compare the cost of studies with and without multi-fidelity.
+    """
+
+    def __init__(self, study: optuna.Study, client: Client, settings: TraceSettings | None = None,
+                 max_in_flight: int | None = None, retries: int = DEFAULT_RETRIES,
+                 fidelities: list[int] | None = None, max_rays_per_task: int | None = None,
+                 trace: Callable[..., TraceResult] = trace_design):
+        self.study = study
+        self.client = client
+        self.settings = settings or TraceSettings()
+        self.max_in_flight = max_in_flight or max(len(client.scheduler_info()['workers']), 1)
+        self.retries = retries
+        self.fidelities = list(fidelities or [self.settings.number_of_rays])
+        if any(a >= b for a, b in zip(self.fidelities, self.fidelities[1:])):
+            raise ValueError(f"fidelities must be increasing: {self.fidelities}")
+        self.max_rays_per_task = max_rays_per_task
+        self.trace = trace
+        self.worker_seconds = 0.0
+        self._in_flight: dict[Future, tuple[_TrialRun, int, int, int]] = {}  # run, rays, chunk, attempts
+        self._queue: list[tuple[int, int, _TrialRun, int, int]] = []  # heap of (-rung, order, run, rays, chunk)
+        self._order = itertools.count()
+        self._futures = as_completed()
+
+    def run(self, n_trials: int):
+        asked = self._fill(n_trials)
+        for future in self._futures:
+            run, rays, chunk, attempts = self._in_flight.pop(future)
+            run.futures.discard(future)
+            if not run.finished:
+                self._handle(future, run, rays, chunk, attempts)
+            future.release()
+            asked += self._fill(n_trials - asked)
+
+    def _fill(self, n_trials: int) -> int:
+        # Uses the free slots for the queued tasks, and then for up to n_trials new trials
+        asked = 0
+        while len(self._in_flight) < self.max_in_flight:
+            if self._queue:
+                _, _, run, rays, chunk = heapq.heappop(self._queue)
+                run.queued -= 1
+                if not run.finished:
+                    self._submit(run, rays, chunk, 1)
+            elif asked < n_trials:
+                asked += self._ask()
+            else:
+                break
+        return asked
+
+    def _handle(self, future: Future, run: _TrialRun, rays: int, chunk: int, attempts: int):
+        try:
+            result: TraceResult = future.result()
+        except WORKER_LOST_ERRORS:
+            if attempts <= self.retries:
+                run.attempts += 1
+                self._submit(run, rays, chunk, attempts + 1)
+            else:
+                self._fail(run, 'worker lost')
+        except Exception as e:
+            self._fail(run, repr(e))
+        else:
+            self._collect(run, result)
+
+    def _ask(self) -> int:
+        trial = self.study.ask()
+        parameters = suggest_parameters(trial)
+        if not DesignGeometry.from_parameters(parameters).feasible:
+            trial.set_user_attr('feasible', False)
+            self.study.tell(trial, 0.0)
+            return 1
+        run = _TrialRun(trial, parameters, time.perf_counter())
+        self._submit_rung(run)
+        return 1
+
+    def _submit_rung(self, run: _TrialRun):
+        traced = run.result.number_of_rays if run.result else 0
+        rays = self.fidelities[run.rung] - traced
+        chunk = self.max_rays_per_task or rays
+        while rays > 0:
+            heapq.heappush(self._queue, (-run.rung, next(self._order), run, min(chunk, rays), run.next_chunk))
+            run.queued += 1
+            run.next_chunk += 1
+            rays -= chunk
+
+    def _submit(self, run: _TrialRun, rays: int, chunk: int, attempts: int):
+        settings = replace(self.settings, number_of_rays=rays)
+        future = self.client.submit(
+            self.trace, parameters=run.parameters, settings=settings, seed=task_seed(run.trial.number, chunk),
+            pure=False, priority=run.rung,
+            key=f'trace-design-{self.study.study_name}-{run.trial.number}-{chunk}-{attempts}')
+        self._in_flight[future] = (run, rays, chunk, attempts)
+        run.futures.add(future)
+        self._futures.add(future)
+
+    def _collect(self, run: _TrialRun, result: TraceResult):
+        self.worker_seconds += sum(result.timings.values())
+        run.result = combine_results([run.result, result]) if run.result else result
+        if run.futures or run.queued:
+            return
+        # every task of the current fidelity is done
+        value = run.result.efficiency_th
+        if run.rung + 1 < len(self.fidelities) and run.result.feasible:
+            run.trial.report(value, step=run.result.number_of_rays)
+            if not run.trial.should_prune():
+                run.rung += 1
+                self._submit_rung(run)
+                return
+            self._finish(run, state=TrialState.PRUNED)
+        else:
+            self._finish(run, value=value)
+
+    def _fail(self, run: _TrialRun, error: str):
+        run.trial.set_user_attr('error', error)
+        for future in run.futures:
+            future.cancel()
+        self._finish(run, state=TrialState.FAIL)
+
+    def _finish(self, run: _TrialRun, value: float | None = None, state: TrialState = TrialState.COMPLETE):
+        run.finished = True
+        trial = run.trial
+        trial.set_user_attr('attempts', run.attempts)
+        trial.set_user_attr('wall_seconds', time.perf_counter() - run.started_at)
+        if run.result is not None:
+            trial.set_user_attr('feasible', run.result.feasible)
+            trial.set_user_attr('rays', run.result.number_of_rays)
+            trial.set_user_attr('efficiency_th_std_error', run.result.efficiency_th_std_error)
+            trial.set_user_attr('worker_seconds', sum(run.result.timings.values()))
+            for key, value_ in run.result.timings.items():
+                trial.set_user_attr(key, value_)
+        if state == TrialState.COMPLETE:
+            self.study.tell(trial, value)
+        else:
+            self.study.tell(trial, state=state)
+
+
+def run_study(study: optuna.Study, client: Client, n_trials: int, settings: TraceSettings | None = None,
+              max_in_flight: int | None = None, retries: int = DEFAULT_RETRIES,
+              fidelities: list[int] | None = None, max_rays_per_task: int | None = None,
+              trace: Callable[..., TraceResult] = trace_design) -> StudyDriver:
+    driver = StudyDriver(study, client, settings, max_in_flight, retries, fidelities, max_rays_per_task, trace)
+    driver.run(n_trials)
+    return driver
+
+
+def trace_design_parallel(client: Client, parameters: ParametersDesign, number_of_rays: int,
+                          n_chunks: int | None = None, settings: TraceSettings | None = None,
+                          seed: int = 0, retries: int = DEFAULT_RETRIES) -> TraceResult:
+    """
+    Traces a single design with `number_of_rays` rays split in `n_chunks`
+    independent tasks (by default, one per worker) with seeds `seed`,
+    `seed + 1`, ... Each task rebuilds the design from the parameters, so the
+    wall time is close to that of one chunk plus one build. The tallies are
+    reduced in the cluster; `efficiency_th_std_error` of the result estimates
+    the error of its efficiency.
+    """
+    settings = settings or TraceSettings()
+    n_chunks = n_chunks or max(len(client.scheduler_info()['workers']), 1)
+    n_chunks = min(n_chunks, number_of_rays)
+    futures = []
+    for chunk in range(n_chunks):
+        # the first number_of_rays % n_chunks chunks get one more ray
+        rays = number_of_rays // n_chunks + (chunk < number_of_rays % n_chunks)
+        futures.append(client.submit(
+            trace_design, parameters=parameters, settings=replace(settings, number_of_rays=rays),
+            seed=seed + chunk, pure=False, retries=retries))
+    return client.submit(combine_results, futures, retries=retries).result()
@@ -0,0 +1,67 @@
+import random
+from importlib.resources import files
+
+import numpy as np
+import otsun
+
+from parameters import ParametersDesign
+from geometry import DesignGeometry
+from design import single_design, design_objects
+from cache import cached_design
+from material_library import ensure_materials
+from profiling import span
+# settings and results live in tracing.py (no FreeCAD or otsun needed) and are re-exported here
+from tracing import APERTURE_AREA, TraceSettings, TraceResult, combine_results
+
+
+def build_experiment(objects: list, settings: TraceSettings) -> otsun.Experiment:
+    # Same setup as otsun.Experiment.from_simple_data, for a list of objects instead of a document
+    scene = otsun.Scene(objects, extra_data={'aperture_th': APERTURE_AREA})
+    main_direction = otsun.polar_to_cartesian(settings.phi, settings.theta) * (-1.0)
+    emitting_region = otsun.GeneralizedSunWindow(scene, main_direction)
+    light_spectrum = settings.wavelength
+    if isinstance(light_spectrum, str):
+        data_file_spectrum = str(files('otsun').joinpath('data', f'{settings.wavelength}.txt'))
+        light_spectrum = otsun.cdf_from_pdf_file(data_file_spectrum)
+    direction_distribution = None
+    if settings.csr_value is not None:
+        direction_distribution = otsun.buie_distribution(settings.csr_value)
+    light_source = otsun.LightSource(scene, emitting_region, light_spectrum, 1.0,
+                                     direction_distribution, None)
+    return otsun.Experiment(scene, light_source, settings.number_of_rays)
+
+
+def trace_design(parameters: ParametersDesign, settings: TraceSettings | None = None,
+                 seed: int | None = None) -> TraceResult:
+    # Builds and traces a design; meant to run in a Dask worker.
+    # Infeasible designs (see DesignGeometry.feasible) are not built.
+    # otsun draws from both `random` and `np.random`, so both are seeded.
+    settings = settings or TraceSettings()
+    timings = {}
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    with span('geometry', timings):
+        feasible = DesignGeometry.from_parameters(parameters).feasible
+    if not feasible:
+        return TraceResult(feasible=False, timings=timings)
+
+    with span('materials', timings):
+        ensure_materials()
+
+    with span('build', timings):
+        objects = design_objects(parameters, cached_design if settings.use_design_cache else single_design)
+
+    with span('trace', timings):
+        experiment = build_experiment(objects, settings)
+        experiment.run()
+
+    return TraceResult(
+        feasible=True,
+        number_of_rays=settings.number_of_rays,
+        captured_energy_th=experiment.captured_energy_Th,
+        captured_energy_th_sq=float(np.sum(np.square(experiment.Th_energy))),
+        emitting_aperture=experiment.light_source.emitting_region.aperture,
+        timings=timings,
+    )
@@ -0,0 +1,229 @@
+import math
+from dataclasses import dataclass, fields
+
+import numpy as np
+
+from parameters import (
+    PRIMARY_FOCUS, APERTURE_WIDTH, RECEIVER_DIAMETER,
+    SECONDARY_GLASS_THICKNESS, THICKNESS_GLASS_COVER,
+    ParametersDesign,
+)
+
+# The aperture angle phi of the truncated CPC used to be found by stepping
+# phi from theta to pi in increments of 1E-6 until the height hi(phi) of the
+# parabola dropped below the truncated height. The closed form below returns
+# the exact root, so it differs from the old scan by at most one step
+# (the scan overshoots the root by less than 1E-6 rad). Derived values
+# (a_cpc_t, m) agree with the scan to a relative error below 1E-5.
+PHI_TOLERANCE = 1E-6
+CPC_RELATIVE_TOLERANCE = 1E-5
+
+
+def cpc_truncation(aperture_cylinder: float, acceptance_angle: float,
+                   truncation_factor: float) -> tuple[float, float, float, float]:
+    """
+    Returns (phi_, a_cpc_t, m, n) for a CPC with emitter window
+    `aperture_cylinder`, semi-acceptance angle `acceptance_angle` (degrees)
+    truncated to `truncation_factor` times its full height.
+
+    phi_ solves hi(phi) = h_cpc_t, where
+    hi(phi) = focal_distance_cpc * cos(phi - theta) / sin(phi / 2) ** 2
+    is strictly decreasing on [theta, pi). Writing c = h_cpc_t / focal_distance_cpc,
+    the equation becomes
+    cos(phi) * (cos(theta) + c / 2) + sin(phi) * sin(theta) = c / 2,
+    whose root in [theta, pi) is delta + arccos(c / (2 * r)), with
+    (r, delta) the polar coordinates of (cos(theta) + c / 2, sin(theta)).
+    """
+    a = aperture_cylinder / 2  # half absorber width
+    theta_ = acceptance_angle * math.pi / 180  # acceptance angle for the CPC in radians
+    focal_distance_cpc = a * (1 + math.sin(theta_))  # CPC focal distance
+    h_cpc = focal_distance_cpc * math.cos(theta_) / (math.sin(theta_) ** 2)  # CPC height without truncation
+    h_cpc_t = h_cpc * truncation_factor  # CPC height truncated
+
+    c = h_cpc_t / focal_distance_cpc
+    x = math.cos(theta_) + c / 2
+    y = math.sin(theta_)
+    phi_ = math.atan2(y, x) + math.acos(c / (2 * math.hypot(x, y)))
+
+    a_cpc_t = focal_distance_cpc * math.sin(phi_ - theta_) / (
+        (math.sin(phi_ / 2) ** 2)) - a  # half CPC truncated aperture
+
+    # m and n parameters for the CPC parabolas
+    n = 2 * a * math.cos(theta_)
+    m = (a + a_cpc_t) * math.sin(phi_) / math.sin(phi_ - theta_)
+    return phi_, a_cpc_t, m, n
+
+
+def cpc_truncation_batch(aperture_cylinder: np.ndarray, acceptance_angle: np.ndarray,
+                         truncation_factor: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorized version of `cpc_truncation`. The arguments are broadcast
+    against each other and every returned array has the broadcast shape.
+    """
+    aperture_cylinder, acceptance_angle, truncation_factor = np.broadcast_arrays(
+        np.asarray(aperture_cylinder, dtype=float),
+        np.asarray(acceptance_angle, dtype=float),
+        np.asarray(truncation_factor, dtype=float))
+    a = aperture_cylinder / 2
+    theta_ = acceptance_angle * np.pi / 180
+    focal_distance_cpc = a * (1 + np.sin(theta_))
+    h_cpc = focal_distance_cpc * np.cos(theta_) / (np.sin(theta_) ** 2)
+    h_cpc_t = h_cpc * truncation_factor
+
+    c = h_cpc_t / focal_distance_cpc
+    x = np.cos(theta_) + c / 2
+    y = np.sin(theta_)
+    phi_ = np.arctan2(y, x) + np.arccos(c / (2 * np.hypot(x, y)))
+
+    a_cpc_t = focal_distance_cpc * np.sin(phi_ - theta_) / (np.sin(phi_ / 2) ** 2) - a
+
+    n = 2 * a * np.cos(theta_)
+    m = (a + a_cpc_t) * np.sin(phi_) / np.sin(phi_ - theta_)
+    return phi_, a_cpc_t, m, n
+
+
+# Errors taken into account when sizing the secondary mirror
+S_SUN = 4.65 / 2 / 1000
+S_M = 2.4529 / 2 / 1000
+S_S = 2 / 1000
+S_T = 0.2 * np.pi / 180
+S_A = 2 / 1000
+SECONDARY_WIDTH_MAX = 80
+MIRROR_GAP_MARGIN = 20
+MIN_CPC_HEIGHT = 1E-3  # shorter CPCs are degenerate
+
+
+@dataclass
+class DesignGeometry:
+    """
+    Values derived from a ParametersDesign that are needed to build the
+    FreeCAD document, computed with NumPy only.
+
+    Built with `from_parameters` every field is a scalar; built with
+    `from_array` (from a PARAMETERS_DTYPE structured array) every field is an
+    array with the shape of the input.
+
+    The CPC side "a" lies at x < 0 and side "b" is its mirror image. Along
+    each side x is monotone and z increases from the emitter window
+    (x = -a, z = height_absorber) to the truncated aperture
+    (x = -a_cpc_t, z = height_absorber + h_cpc_t), so these two points are
+    the corners of its bounding box.
+    """
+    secondary_width: float  # width of the secondary mirror
+    mirror_gap: float  # separation space between primary mirror sections
+    secondary_height: float  # height of the vertex of the secondary mirror
+    height_absorber: float  # height of the cylinder aperture (CPC emitter window)
+    theta: float  # acceptance angle for the CPC in radians
+    focal_distance_cpc: float
+    h_cpc_t: float  # CPC height truncated
+    phi: float  # aperture angle of the truncated CPC
+    a_cpc_t: float  # half CPC truncated aperture
+    m: float  # parameters for the CPC parabolas
+    n: float
+    x_pos: float  # X placement parabola for CPC
+    y_pos: float  # Y placement parabola for CPC
+    cylinder_arc_x: float  # cylinder arc goes from (-x, z) through (0, z_bottom) to (x, z)
+    cylinder_arc_z: float
+    cylinder_arc_bottom_z: float
+    glass_x: float  # the cover glass spans from glass_x to -glass_x at height glass_z
+    glass_z: float
+    glass_length: float
+    feasible: bool
+
+    @classmethod
+    def from_parameters(cls, parameters: ParametersDesign) -> 'DesignGeometry':
+        values = _design_geometry(
+            parameters.secondary_focus, parameters.height_cylinder, parameters.cylinder_diameter,
+            parameters.aperture_cylinder, parameters.acceptance_angle, parameters.truncation_factor)
+        return DesignGeometry(**{key: value.item() for key, value in values.items()})
+
+    @classmethod
+    def from_array(cls, parameters: np.ndarray) -> 'DesignGeometry':
+        return DesignGeometry(**_design_geometry(
+            parameters['secondary_focus'], parameters['height_cylinder'], parameters['cylinder_diameter'],
+            parameters['aperture_cylinder'], parameters['acceptance_angle'], parameters['truncation_factor']))
+
+    def as_dict(self) -> dict:
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+def _design_geometry(secondary_focus, height_cylinder, cylinder_diameter,
+                     aperture_cylinder, acceptance_angle, truncation_factor) -> dict[str, np.ndarray]:
+    (secondary_focus, height_cylinder, cylinder_diameter,
+     aperture_cylinder, acceptance_angle, truncation_factor) = np.broadcast_arrays(
+        *(np.asarray(x, dtype=float) for x in
+          (secondary_focus, height_cylinder, cylinder_diameter,
+           aperture_cylinder, acceptance_angle, truncation_factor)))
+
+    #### PRIMARY / SECONDARY ####
+
+    semiaperture = APERTURE_WIDTH / 2
+    # ray deviated due to optical errors
+    sigma = ((2 * S_SUN) ** 2 + (2 * S_M) ** 2 + (2 * S_S) ** 2 + (2 * S_T) ** 2 + (2 * S_A) ** 2) ** 0.5
+    _angle = np.arctan(PRIMARY_FOCUS / semiaperture) + sigma
+    z_point = np.tan(_angle) * semiaperture
+    secondary_height = PRIMARY_FOCUS - secondary_focus
+    secondary_width = np.minimum(
+        2 * (z_point - secondary_height) * semiaperture / z_point, SECONDARY_WIDTH_MAX)
+    mirror_gap = secondary_width + MIRROR_GAP_MARGIN
+
+    #### CPC ####
+
+    with np.errstate(invalid='ignore'):
+        angle_ = np.arcsin((aperture_cylinder / 2) / (cylinder_diameter / 2))
+    height_absorber = height_cylinder + (cylinder_diameter / 2) * np.cos(angle_)
+    a = aperture_cylinder / 2
+    theta_ = acceptance_angle * np.pi / 180
+    focal_distance_cpc = a * (1 + np.sin(theta_))
+    h_cpc_t = focal_distance_cpc * np.cos(theta_) / (np.sin(theta_) ** 2) * truncation_factor
+    phi_, a_cpc_t, m, n = cpc_truncation_batch(aperture_cylinder, acceptance_angle, truncation_factor)
+    x_pos = a - focal_distance_cpc * np.sin(theta_)
+    y_pos = focal_distance_cpc * np.cos(theta_)
+
+    #### CYLINDER AND COVER GLASS ####
+
+    cylinder_arc_x = a
+    cylinder_arc_z = height_absorber
+    cylinder_arc_bottom_z = height_cylinder - cylinder_diameter / 2
+    glass_x = -a_cpc_t
+    glass_z = height_absorber + h_cpc_t
+    glass_length = 2 * a_cpc_t
+
+    #### FEASIBILITY ####
+
+    feasible = (
+        # the emitter window must fit in the cylinder
+        (aperture_cylinder < cylinder_diameter)
+        # the receiver tube must fit in the cylinder
+        & (RECEIVER_DIAMETER < cylinder_diameter)
+        # the CPC must have a positive height (at truncation_factor 0, m == n
+        # analytically, but not exactly in floating point)
+        & (h_cpc_t > MIN_CPC_HEIGHT)
+        # the CPC and its cover glass must stay below the secondary mirror
+        & (glass_z + THICKNESS_GLASS_COVER < secondary_height - SECONDARY_GLASS_THICKNESS)
+    )
+
+    values = dict(
+        secondary_width=secondary_width,
+        mirror_gap=mirror_gap,
+        secondary_height=secondary_height,
+        height_absorber=height_absorber,
+        theta=theta_,
+        focal_distance_cpc=focal_distance_cpc,
+        h_cpc_t=h_cpc_t,
+        phi=phi_,
+        a_cpc_t=a_cpc_t,
+        m=m,
+        n=n,
+        x_pos=x_pos,
+        y_pos=y_pos,
+        cylinder_arc_x=cylinder_arc_x,
+        cylinder_arc_z=cylinder_arc_z,
+        cylinder_arc_bottom_z=cylinder_arc_bottom_z,
+        glass_x=glass_x,
+        glass_z=glass_z,
+        glass_length=glass_length,
+        feasible=feasible,
+    )
+    shape = secondary_focus.shape
+    return {key: np.broadcast_to(value, shape).copy() for key, value in values.items()}
@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from distributed import WorkerPlugin
+from otsun import Material
+
+# The .otmaterial files are JSON with large tabulated arrays, slow to parse.
+# Each of them is converted once to a .npz file holding the arrays (stored
+# uncompressed) and, under the key SPEC_KEY, the JSON of the material with
+# every array replaced by a reference to its key in the .npz.
+MATERIALS_DIR = Path(os.environ.get('MATERIALS_DIR', Path(__file__).resolve().parent / 'materials'))
+COMPILED_MATERIALS_DIR = Path(os.environ.get(
+    'COMPILED_MATERIALS_DIR', Path(__file__).resolve().parent / 'materials_npz'))
+SPEC_KEY = '__spec__'
+ARRAY_TYPES = ('tabulated', 'matrix')
+
+# Materials loaded in this process, with the time it took to load them
+_loaded: dict = {}
+
+
+def compile_material(source: Path, target: Path):
+    with open(source) as f:
+        info = json.load(f)
+    specs = info if isinstance(info, list) else [info]
+    arrays = {}
+    for i, spec in enumerate(specs):
+        for key, plain_property in spec.get('plain_properties', {}).items():
+            if plain_property['type'] in ARRAY_TYPES:
+                array_key = f'{i}/{key}'
+                arrays[array_key] = np.asarray(plain_property['value'], dtype=float)
+                plain_property['value'] = array_key
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # written to a temporary file and renamed, since several workers may compile at once
+    tmp_target = target.with_name(f'{target.stem}.{os.getpid()}.tmp.npz')
+    np.savez(tmp_target, **arrays, **{SPEC_KEY: np.array(json.dumps(specs))})
+    os.replace(tmp_target, target)
+
+
+def compile_materials(directory: Path = MATERIALS_DIR, compiled_directory: Path = COMPILED_MATERIALS_DIR,
+                      force: bool = False) -> list[Path]:
+    # Compiles the .otmaterial files that are newer than their .npz; returns the .npz files
+    targets = []
+    for source in sorted(Path(directory).glob('*.otmaterial')):
+        target = Path(compiled_directory) / f'{source.stem}.npz'
+        if force or not target.exists() or target.stat().st_mtime < source.stat().st_mtime:
+            compile_material(source, target)
+        targets.append(target)
+    return targets
+
+
+def load_compiled_material(path: Path) -> list[str]:
+    with np.load(path, allow_pickle=False) as data:
+        specs = json.loads(str(data[SPEC_KEY]))
+        for spec in specs:
+            for plain_property in spec.get('plain_properties', {}).values():
+                if plain_property['type'] in ARRAY_TYPES:
+                    # plain_properties keep the arrays instead of the original lists
+                    plain_property['value'] = data[plain_property['value']]
+    names = Material.load_from_json(specs)
+    return names if isinstance(names, list) else [names]
+
+
+def load_materials(directory: Path = MATERIALS_DIR, compiled_directory: Path = COMPILED_MATERIALS_DIR,
+                   use_compiled: bool = True) -> dict:
+    # Loads all the materials in `directory` into otsun, from their compiled
+    # version if `use_compiled`, and returns the names loaded and the time spent
+    start = time.perf_counter()
+    names = []
+    if use_compiled:
+        for path in compile_materials(directory, compiled_directory):
+            names.extend(load_compiled_material(path))
+    else:
+        for source in sorted(Path(directory).glob('*.otmaterial')):
+            name = Material.load_from_json_file(str(source))
+            names.extend(name if isinstance(name, list) else [name])
+    return {
+        'names': names,
+        'use_compiled': use_compiled,
+        'load_seconds': time.perf_counter() - start,
+    }
+
+
+def ensure_materials(directory: Path = MATERIALS_DIR) -> dict:
+    # Loads the materials once per process; every trial should call this
+    # before tracing. Returns the report of the first load plus the time of this call.
+    start = time.perf_counter()
+    if str(directory) not in _loaded:
+        _loaded[str(directory)] = load_materials(directory)
+    return dict(_loaded[str(directory)], ensure_seconds=time.perf_counter() - start)
+
+
+def compare_load_times(directory: Path = MATERIALS_DIR, repeat: int = 3) -> dict:
+    # Best time of `repeat` loads from JSON and from the compiled files
+    compile_materials(directory)
+    results = {}
+    for use_compiled in (False, True):
+        times = [load_materials(directory, use_compiled=use_compiled)['load_seconds']
+                 for _ in range(repeat)]
+        results['compiled' if use_compiled else 'json'] = min(times)
+    return results
+
+
+class MaterialsPlugin(WorkerPlugin):
+    """
+    Loads the materials in every Dask worker at startup, so that trials never
+    parse them. Register it from the client with
+    `client.register_plugin(MaterialsPlugin())`.
+    """
+    name = 'otsun-materials'
+
+    def __init__(self, directory: str = str(MATERIALS_DIR)):
+        self.directory = directory
+
+    def setup(self, worker):
+        worker.otsun_materials = ensure_materials(Path(self.directory))
+
+
+def worker_materials_reports(client) -> dict:
+    # Load report of every worker, keyed by worker address
+    return client.run(lambda dask_worker: getattr(dask_worker, 'otsun_materials', None))
+
+
+if __name__ == '__main__':
+    # Run at image build time: python material_library.py [materials_dir]
+    directory = Path(sys.argv[1]) if len(sys.argv) > 1 else MATERIALS_DIR
+    for target in compile_materials(directory, force=True):
+        print(f'{target} ({target.stat().st_size} bytes)')
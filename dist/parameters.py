@@ -0,0 +1,72 @@
+from dataclasses import dataclass, astuple, fields
+
+import numpy as np
+
+# CONSTANT PARAMETERS
+PRIMARY_FOCUS = 800  # Focal distance of the primary mirror
+PRIMARY_LENGTH = 4900  # Primary mirror length
+APERTURE_WIDTH = 1250  # Total width of the primary mirror
+RECEIVER_DIAMETER = 15  # Outer diameter of the receiver tube
+PRIMARY_GLASS_THICKNESS = 1  #
+SECONDARY_GLASS_THICKNESS = 1  #
+THICKNESS_GLASS_COVER = 4  #
+
+# VARIABLE PARAMETERS
+
+SECONDARY_FOCUS_MIN = 40
+SECONDARY_FOCUS_MAX = 80
+# SECONDARY_FOCUS = np.arange(40, 81, 20)  # Focal distance of the secondary mirror
+HEIGHT_CYLINDER_MIN = 100
+HEIGHT_CYLINDER_MAX = 250
+# HEIGHT_CYLINDER = np.arange(100, 251, 50)  # Height of the integrating cylinder center
+CYLINDER_DIAMETER_MIN = 35
+CYLINDER_DIAMETER_MAX = 60
+# CYLINDER_DIAMETER = np.arange(40, 60.1, 10)  # Diameter of the integrating cylinder
+APERTURE_CYLINDER_MIN = 13.5
+APERTURE_CYLINDER_MAX = 37.5
+# APERTURE_CYLINDER = np.arange(13.5, 37.6, 6)  # Aperture of the integrating cylinder
+ACCEPTANCE_ANGLE_MIN = 20
+ACCEPTANCE_ANGLE_MAX = 60
+# ACCEPTANCE_ANGLE = np.arange(20.0, 60.01, 10)  # Semi-acceptance angle of the CPC mirror
+TRUNCATION_FACTOR_MIN = 0.0
+TRUNCATION_FACTOR_MAX = 1.0
+
+@dataclass
+class ParametersDesign:
+    secondary_focus: float
+    height_cylinder: float
+    cylinder_diameter: float
+    aperture_cylinder: float
+    acceptance_angle: float
+    truncation_factor: float
+    cylinder_material: bool
+
+    @classmethod
+    def random_parameters(cls) -> 'ParametersDesign':
+        return ParametersDesign(
+            secondary_focus = np.random.uniform(SECONDARY_FOCUS_MIN, SECONDARY_FOCUS_MAX),
+            height_cylinder = np.random.uniform(HEIGHT_CYLINDER_MIN, HEIGHT_CYLINDER_MAX),
+            cylinder_diameter = np.random.uniform(CYLINDER_DIAMETER_MIN, CYLINDER_DIAMETER_MAX),
+            aperture_cylinder = np.random.uniform(APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX),
+            acceptance_angle = np.random.uniform(ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX),
+            truncation_factor = np.random.uniform(TRUNCATION_FACTOR_MIN, TRUNCATION_FACTOR_MAX),
+            cylinder_material = np.random.choice([True, False])
+        )
+
+    def as_tuple(self) -> tuple:
+        return astuple(self)
+
+    @classmethod
+    def from_tuple(cls, values: tuple) -> 'ParametersDesign':
+        return ParametersDesign(*values)
+
+
+# Structured dtype used to hold many ParametersDesign in a single NumPy array
+PARAMETERS_DTYPE = np.dtype([
+    (field.name, np.bool_ if field.type is bool else np.float64)
+    for field in fields(ParametersDesign)
+])
+
+
+def parameters_array(parameters: list[ParametersDesign]) -> np.ndarray:
+    return np.array([p.as_tuple() for p in parameters], dtype=PARAMETERS_DTYPE)
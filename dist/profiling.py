@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from distributed.metrics import context_meter
+
+# Timing spans of the hot path (design building, material loading, tracing).
+# When profiling is enabled (OTSUN_PROFILE=1, or enable_profiling()), every span
+# is added to the running count and total of its name in `span_totals` and,
+# inside a Dask task, reported as a fine performance metric (without the time of
+# the spans nested in it), shown per task in the "Fine Performance Metrics" page
+# of the Dask dashboard. The time of every
+# single call is only kept inside `record_spans` (used by benchmark.py), so that
+# long-running workers do not grow. When disabled, a span only costs two
+# perf_counter calls.
+_enabled = os.environ.get('OTSUN_PROFILE', '0') == '1'
+span_totals: dict[str, dict] = {}  # name -> {'calls': ..., 'total_seconds': ...}
+_recorders: list[dict[str, list[float]]] = []
+
+
+def enable_profiling(enabled: bool = True):
+    global _enabled
+    _enabled = enabled
+
+
+def enable_profiling_on_workers(client, enabled: bool = True):
+    client.run(enable_profiling, enabled)
+
+
+def profiling_enabled() -> bool:
+    return _enabled
+
+
+def clear_spans():
+    span_totals.clear()
+
+
+def get_span_totals() -> dict:
+    return span_totals
+
+
+def worker_span_totals(client) -> dict:
+    # span_totals of every worker, by worker address
+    return client.run(get_span_totals)
+
+
+@contextmanager
+def record_spans() -> Iterator[dict[str, list[float]]]:
+    # Keeps the time of every span ended inside the block, by name
+    recorded = {}
+    _recorders.append(recorded)
+    try:
+        yield recorded
+    finally:
+        _recorders.remove(recorded)
+
+
+@contextmanager
+def span(name: str, timings: dict | None = None):
+    # Times the block; the time is added to timings[f'{name}_seconds'] if `timings` is given.
+    # `timings`, `span_totals` and `record_spans` get the inclusive time of the block;
+    # the Dask metric gets its exclusive time (context_meter.meter subtracts the
+    # nested spans), so that nested spans are not counted twice in the dashboard.
+    enabled = _enabled
+    start = time.perf_counter()
+    try:
+        if enabled:
+            with context_meter.meter(name):
+                yield
+        else:
+            yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings is not None:
+            key = f'{name}_seconds'
+            timings[key] = timings.get(key, 0.0) + elapsed
+        if enabled:
+            total = span_totals.setdefault(name, {'calls': 0, 'total_seconds': 0.0})
+            total['calls'] += 1
+            total['total_seconds'] += elapsed
+            for recorded in _recorders:
+                recorded.setdefault(name, []).append(elapsed)
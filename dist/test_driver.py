@@ -0,0 +1,121 @@
+import time
+
+import numpy as np
+import optuna
+import pytest
+from distributed import Client, LocalCluster
+from optuna.trial import TrialState
+
+from parameters import ParametersDesign
+from tracing import APERTURE_AREA, TraceSettings, TraceResult
+from driver import StudyDriver, run_study, task_seed
+
+# Tests of the ask/tell loop of StudyDriver on a local Dask cluster, with a
+# stand-in for evaluation.trace_design (no FreeCAD or otsun needed): each ray
+# is captured with probability truncation_factor, so the efficiency of a
+# design is known.
+
+
+def fake_trace(parameters: ParametersDesign, settings: TraceSettings, seed: int) -> TraceResult:
+    time.sleep(0.002)
+    energies = np.random.default_rng(seed).random(settings.number_of_rays) < parameters.truncation_factor
+    return TraceResult(
+        feasible=True,
+        number_of_rays=settings.number_of_rays,
+        captured_energy_th=float(np.sum(energies)),
+        captured_energy_th_sq=float(np.sum(energies)),
+        emitting_aperture=APERTURE_AREA,
+        timings={'trace_seconds': 0.002},
+    )
+
+
+def failing_trace(parameters: ParametersDesign, settings: TraceSettings, seed: int) -> TraceResult:
+    if parameters.cylinder_material:
+        raise ValueError('OCC failure')
+    return fake_trace(parameters, settings, seed)
+
+
+class RecordingDriver(StudyDriver):
+    # Keeps the largest number of tasks in flight
+    max_seen = 0
+
+    def _submit(self, *args):
+        super()._submit(*args)
+        self.max_seen = max(self.max_seen, len(self._in_flight))
+
+
+@pytest.fixture(scope='module')
+def client():
+    with LocalCluster(n_workers=2, threads_per_worker=1, processes=False, dashboard_address=None) as cluster, \
+            Client(cluster) as client:
+        yield client
+
+
+def _study(pruner: optuna.pruners.BasePruner | None = None) -> optuna.Study:
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    return optuna.create_study(direction='maximize', sampler=optuna.samplers.RandomSampler(seed=0),
+                               pruner=pruner or optuna.pruners.NopPruner())
+
+
+def _feasible(trial: optuna.trial.FrozenTrial) -> bool:
+    return trial.user_attrs.get('feasible', True)
+
+
+def test_every_trial_is_told(client):
+    study = _study()
+    driver = run_study(study, client, 12, TraceSettings(number_of_rays=200), trace=fake_trace)
+    assert len(study.trials) == 12
+    assert all(trial.state == TrialState.COMPLETE for trial in study.trials)
+    for trial in filter(_feasible, study.trials):
+        assert trial.user_attrs['rays'] == 200
+        assert trial.user_attrs['attempts'] == 1
+        # the efficiency is about truncation_factor
+        assert trial.value == pytest.approx(trial.params['truncation_factor'], abs=0.15)
+    assert driver.worker_seconds > 0
+
+
+def test_escalation_respects_max_in_flight(client):
+    study = _study()
+    driver = RecordingDriver(study, client, max_in_flight=2, fidelities=[100, 400], max_rays_per_task=50,
+                             trace=fake_trace)
+    driver.run(6)
+    assert driver.max_seen <= 2
+    assert all(trial.state == TrialState.COMPLETE for trial in study.trials)
+    assert all(trial.user_attrs['rays'] == 400 for trial in filter(_feasible, study.trials))
+
+
+def test_pruning_at_geometric_fidelities(client):
+    pruner = optuna.pruners.SuccessiveHalvingPruner(min_resource=100, reduction_factor=4)
+    study = _study(pruner)
+    run_study(study, client, 30, fidelities=[100, 400, 1600], trace=fake_trace)
+    states = [trial.state for trial in study.trials]
+    assert len(states) == 30
+    assert TrialState.PRUNED in states
+    for trial in filter(_feasible, study.trials):
+        assert set(trial.intermediate_values) <= {100, 400}
+        if trial.state == TrialState.PRUNED:
+            assert trial.user_attrs['rays'] in (100, 400)
+        else:
+            assert trial.user_attrs['rays'] == 1600
+
+
+def test_failed_task_fails_its_trial_once(client):
+    study = _study()
+    run_study(study, client, 12, TraceSettings(number_of_rays=200), max_rays_per_task=50, trace=failing_trace)
+    assert len(study.trials) == 12
+    for trial in filter(_feasible, study.trials):
+        if trial.params['cylinder_material']:
+            assert trial.state == TrialState.FAIL
+            assert 'OCC failure' in trial.user_attrs['error']
+        else:
+            assert trial.state == TrialState.COMPLETE
+            assert trial.user_attrs['rays'] == 200
+    # the remaining chunks of the failed trials were cancelled or ignored
+    assert TrialState.FAIL in [trial.state for trial in study.trials]
+
+
+def test_task_seeds_fit_np_random_seed():
+    seeds = [task_seed(trial, chunk) for trial in (0, 65535, 65536, 10 ** 9) for chunk in range(8)]
+    assert len(set(seeds)) == len(seeds)
+    for seed in seeds:
+        np.random.seed(seed)
@@ -0,0 +1,157 @@
+import math
+
+import numpy as np
+import pytest
+
+from parameters import (
+    APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX,
+    ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX,
+    ParametersDesign, parameters_array,
+)
+from geometry import (
+    PHI_TOLERANCE, CPC_RELATIVE_TOLERANCE, DesignGeometry, cpc_truncation, cpc_truncation_batch,
+)
+
+# Regression test of the closed-form CPC truncation against the scan that
+# single_design used before, and tests of the values of DesignGeometry that
+# single_design used to read from the bounding boxes of the CPC parabolas.
+# They only need NumPy:
+#
+#   python -m pytest dist
+
+
+def cpc_truncation_scan(aperture_cylinder: float, acceptance_angle: float,
+                        truncation_factor: float) -> tuple[float, float, float, float]:
+    # The old algorithm of single_design, kept as the reference
+    a = aperture_cylinder / 2
+    theta_ = acceptance_angle * np.pi / 180
+    focal_distance_cpc = a * (1 + math.sin(theta_))
+    h_cpc = focal_distance_cpc * math.cos(theta_) / (math.sin(theta_) ** 2)
+    h_cpc_t = h_cpc * truncation_factor
+
+    for phi_ in np.arange(theta_, np.pi, 1E-6):
+        hi = focal_distance_cpc * math.cos(phi_ - theta_) / (math.sin(phi_ / 2) ** 2)
+        if (hi < h_cpc_t):
+            break
+
+    a_cpc_t = focal_distance_cpc * math.sin(phi_ - theta_) / (
+        (math.sin(phi_ / 2) ** 2)) - a
+
+    n = 2 * a * math.cos(theta_)
+    m = (a + a_cpc_t) * math.sin(phi_) / math.sin(phi_ - theta_)
+    return phi_, a_cpc_t, m, n
+
+
+def _cases() -> list[tuple[float, float, float]]:
+    rng = np.random.default_rng(0)
+    cases = [(float(rng.uniform(APERTURE_CYLINDER_MIN, APERTURE_CYLINDER_MAX)),
+              float(rng.uniform(ACCEPTANCE_ANGLE_MIN, ACCEPTANCE_ANGLE_MAX)),
+              float(rng.uniform(0.0, 1.0)))
+             for _ in range(6)]
+    # the ends of the truncation range and of the acceptance angle range
+    cases += [(APERTURE_CYLINDER_MIN, ACCEPTANCE_ANGLE_MAX, 0.0),
+              (APERTURE_CYLINDER_MAX, ACCEPTANCE_ANGLE_MIN, 1.0),
+              (25.0, 40.0, 0.0),
+              (25.0, 40.0, 1.0)]
+    return cases
+
+
+CASES = _cases()
+
+
+@pytest.mark.parametrize('aperture_cylinder, acceptance_angle, truncation_factor', CASES)
+def test_cpc_truncation_matches_scan(aperture_cylinder, acceptance_angle, truncation_factor):
+    phi_, a_cpc_t, m, n = cpc_truncation(aperture_cylinder, acceptance_angle, truncation_factor)
+    phi_ref, a_cpc_t_ref, m_ref, n_ref = cpc_truncation_scan(aperture_cylinder, acceptance_angle, truncation_factor)
+    assert abs(phi_ - phi_ref) <= PHI_TOLERANCE
+    assert a_cpc_t == pytest.approx(a_cpc_t_ref, rel=CPC_RELATIVE_TOLERANCE)
+    assert m == pytest.approx(m_ref, rel=CPC_RELATIVE_TOLERANCE)
+    assert n == pytest.approx(n_ref, rel=CPC_RELATIVE_TOLERANCE)
+
+
+def test_cpc_truncation_batch_matches_scalar():
+    aperture_cylinder, acceptance_angle, truncation_factor = (np.array(values) for values in zip(*CASES))
+    batch = cpc_truncation_batch(aperture_cylinder, acceptance_angle, truncation_factor)
+    for i, case in enumerate(CASES):
+        scalar = cpc_truncation(*case)
+        for batch_value, scalar_value in zip(batch, scalar):
+            assert batch_value[i] == pytest.approx(scalar_value, rel=1E-12)
+
+
+def test_cpc_truncation_batch_broadcasts():
+    phi_, a_cpc_t, m, n = cpc_truncation_batch(np.array([15.0, 25.0, 35.0]), 40.0, np.array([[0.0], [0.5], [1.0]]))
+    for values in (phi_, a_cpc_t, m, n):
+        assert values.shape == (3, 3)
+
+
+def _random_parameters(n: int, seed: int = 0) -> list[ParametersDesign]:
+    np.random.seed(seed)
+    return [ParametersDesign.random_parameters() for _ in range(n)]
+
+
+def _cpc_side_a(g: DesignGeometry, samples: int = 201) -> tuple[np.ndarray, np.ndarray]:
+    # (x, z) of the CPC parabola of side "a" as built by single_design: the
+    # parabola x = t ** 2 / (4 * focal) of the XY plane, for t in [n, m],
+    # rotated -theta and 90 degrees around Z, 90 degrees around X (so that
+    # y becomes z) and translated to (x_pos, 0, height_absorber - y_pos).
+    # Every field of `g` is an array of designs; the samples go in the last axis.
+    t = np.linspace(g.n, g.m, samples, axis=-1)
+    x = t ** 2 / (4 * g.focal_distance_cpc[..., None])
+    y = t
+    theta = -g.theta[..., None]
+    x, y = x * np.cos(theta) - y * np.sin(theta), x * np.sin(theta) + y * np.cos(theta)
+    x, y = -y, x
+    return x + g.x_pos[..., None], y - g.y_pos[..., None] + g.height_absorber[..., None]
+
+
+def test_from_array_matches_from_parameters():
+    parameters = _random_parameters(50)
+    batch = DesignGeometry.from_array(parameters_array(parameters))
+    for i, p in enumerate(parameters):
+        single = DesignGeometry.from_parameters(p)
+        for name, value in single.as_dict().items():
+            if name == 'feasible':
+                assert getattr(batch, name)[i] == value
+            else:
+                np.testing.assert_allclose(getattr(batch, name)[i], value, rtol=1E-12, equal_nan=True)
+
+
+def test_cylinder_arc_and_glass_match_cpc_bounding_box():
+    parameters = [p for p in _random_parameters(2000, seed=1)
+                  if DesignGeometry.from_parameters(p).feasible]
+    g = DesignGeometry.from_array(parameters_array(parameters))
+    assert len(parameters) > 500
+    x_a, z = _cpc_side_a(g)
+    # side "b" is side "a" rotated 180 degrees around Z
+    x_b = -x_a
+    # the arc joins (XMax, ZMin) of side "a" and (XMin, ZMin) of side "b"
+    np.testing.assert_allclose(x_a.max(axis=-1), -g.cylinder_arc_x, atol=1E-9)
+    np.testing.assert_allclose(x_b.min(axis=-1), g.cylinder_arc_x, atol=1E-9)
+    np.testing.assert_allclose(z.min(axis=-1), g.cylinder_arc_z, atol=1E-9)
+    # the glass goes from (XMin, ZMax) of side "a" to XMax of side "b"
+    np.testing.assert_allclose(x_a.min(axis=-1), g.glass_x, atol=1E-9)
+    np.testing.assert_allclose(z.max(axis=-1), g.glass_z, atol=1E-9)
+    np.testing.assert_allclose(x_b.max(axis=-1) - x_a.min(axis=-1), g.glass_length, atol=1E-9)
+
+
+FEASIBLE = ParametersDesign(secondary_focus=60, height_cylinder=150, cylinder_diameter=50,
+                            aperture_cylinder=25, acceptance_angle=40, truncation_factor=0.5,
+                            cylinder_material=True)
+
+
+@pytest.mark.parametrize('changes, feasible', [
+    ({}, True),
+    ({'aperture_cylinder': 49.9}, True),
+    ({'aperture_cylinder': 50}, False),
+    ({'aperture_cylinder': 55}, False),
+    ({'truncation_factor': 0.01}, True),
+    ({'truncation_factor': 0.0}, False),
+    ({'aperture_cylinder': 13.5, 'acceptance_angle': 60, 'truncation_factor': 0.0}, False),
+    ({'aperture_cylinder': 20, 'acceptance_angle': 33.3, 'truncation_factor': 0.0}, False),
+    ({'aperture_cylinder': 13.5, 'cylinder_diameter': 14.5}, False),  # the receiver does not fit
+    ({'height_cylinder': 700}, False),
+])
+def test_feasible_boundaries(changes, feasible):
+    parameters = ParametersDesign(**{**FEASIBLE.__dict__, **changes})
+    assert DesignGeometry.from_parameters(parameters).feasible == feasible
+    assert DesignGeometry.from_array(parameters_array([parameters])).feasible[0] == feasible
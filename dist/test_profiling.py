@@ -0,0 +1,72 @@
+import time
+
+import pytest
+from distributed.metrics import context_meter
+
+import profiling
+
+
+@pytest.fixture
+def profiling_enabled():
+    profiling.clear_spans()
+    profiling.enable_profiling()
+    yield
+    profiling.enable_profiling(False)
+    profiling.clear_spans()
+
+
+def _digests(block) -> dict[str, float]:
+    # Dask metrics digested by `block`, added by label
+    digests = {}
+
+    def callback(label, value, unit):
+        if unit == 'seconds':
+            digests[label] = digests.get(label, 0.0) + value
+
+    with context_meter.add_callback(callback):
+        block()
+    return digests
+
+
+def _nested_spans(timings: dict):
+    with profiling.span('outer', timings):
+        time.sleep(0.02)
+        with profiling.span('inner', timings):
+            time.sleep(0.02)
+            with profiling.span('innermost', timings):
+                time.sleep(0.02)
+
+
+def test_nested_spans_are_not_counted_twice_by_dask(profiling_enabled):
+    timings = {}
+    digests = _digests(lambda: _nested_spans(timings))
+    # Dask gets the exclusive time of each span: they add up to the outer span
+    assert set(digests) == {'outer', 'inner', 'innermost'}
+    assert sum(digests.values()) == pytest.approx(timings['outer_seconds'], abs=1E-3)
+    assert digests['outer'] < timings['outer_seconds'] - 0.03
+    # timings and span_totals keep the inclusive time
+    assert timings['outer_seconds'] > timings['inner_seconds'] > timings['innermost_seconds'] >= 0.02
+    assert profiling.span_totals['outer'] == {'calls': 1, 'total_seconds': timings['outer_seconds']}
+
+
+def test_span_totals_do_not_grow_with_calls(profiling_enabled):
+    for _ in range(1000):
+        with profiling.span('a'):
+            pass
+    assert profiling.span_totals['a']['calls'] == 1000
+    with profiling.record_spans() as recorded:
+        with profiling.span('a'):
+            pass
+    assert {name: len(times) for name, times in recorded.items()} == {'a': 1}
+    with profiling.span('a'):
+        pass
+    assert len(recorded['a']) == 1
+
+
+def test_disabled_spans_only_fill_timings():
+    profiling.clear_spans()
+    timings = {}
+    digests = _digests(lambda: _nested_spans(timings))
+    assert digests == {}
+    assert profiling.span_totals == {}
+    assert set(timings) == {'outer_seconds', 'inner_seconds', 'innermost_seconds'}
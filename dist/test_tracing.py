@@ -0,0 +1,100 @@
+import math
+
+import numpy as np
+import pytest
+
+from tracing import APERTURE_AREA, TraceResult, combine_results
+
+# Tests of the tallies of TraceResult and of combine_results. They only need NumPy.
+
+EMITTING_APERTURE = 2.0 * APERTURE_AREA
+
+
+def _result(energies: np.ndarray, emitting_aperture: float = EMITTING_APERTURE) -> TraceResult:
+    # The result of a trace in which each ray captured the given energy
+    return TraceResult(
+        feasible=True,
+        number_of_rays=len(energies),
+        captured_energy_th=float(np.sum(energies)),
+        captured_energy_th_sq=float(np.sum(np.square(energies))),
+        emitting_aperture=emitting_aperture,
+        timings={'trace_seconds': 0.001 * len(energies)},
+    )
+
+
+def test_combined_chunks_equal_a_single_run():
+    energies = np.random.default_rng(0).uniform(0.0, 1.0, 10001)
+    single = _result(energies)
+    combined = combine_results([_result(chunk) for chunk in np.array_split(energies, 7)])
+    assert combined.feasible
+    assert combined.number_of_rays == single.number_of_rays
+    assert combined.captured_energy_th == pytest.approx(single.captured_energy_th, rel=1E-12)
+    assert combined.captured_energy_th_sq == pytest.approx(single.captured_energy_th_sq, rel=1E-12)
+    assert combined.emitting_aperture == single.emitting_aperture
+    assert combined.efficiency_th == pytest.approx(single.efficiency_th, rel=1E-12)
+    assert combined.efficiency_th_std_error == pytest.approx(single.efficiency_th_std_error, rel=1E-9)
+    assert combined.timings['trace_seconds'] == pytest.approx(single.timings['trace_seconds'])
+
+
+def test_efficiency_th_is_the_mean_energy_per_ray():
+    energies = np.random.default_rng(1).uniform(0.0, 1.0, 1000)
+    result = _result(energies)
+    # same as otsun.Experiment.efficiency_th
+    assert result.efficiency_th == pytest.approx(
+        (np.sum(energies) / APERTURE_AREA) / (len(energies) / EMITTING_APERTURE))
+    assert result.efficiency_th == pytest.approx(np.mean(energies) * EMITTING_APERTURE / APERTURE_AREA)
+
+
+@pytest.mark.parametrize('n, captured', [(10001, 3000), (1000, 1), (50, 25)])
+def test_std_error_of_captured_or_lost_rays_is_binomial(n, captured):
+    # each ray captures an energy of 1 or 0
+    energies = np.zeros(n)
+    energies[:captured] = 1.0
+    result = _result(energies)
+    p = captured / n
+    scale = EMITTING_APERTURE / APERTURE_AREA
+    assert result.efficiency_th == pytest.approx(scale * p)
+    assert result.efficiency_th_std_error == pytest.approx(scale * math.sqrt(p * (1 - p) / (n - 1)), rel=1E-9)
+
+
+def test_std_error_of_constant_energies_is_zero():
+    assert _result(np.full(100, 0.5)).efficiency_th_std_error == pytest.approx(0.0, abs=1E-12)
+
+
+def test_std_error_needs_two_rays():
+    assert math.isnan(_result(np.array([1.0])).efficiency_th_std_error)
+    assert math.isnan(TraceResult(feasible=True).efficiency_th_std_error)
+
+
+def test_empty_parts_do_not_change_the_emitting_aperture():
+    # chunks with no rays (e.g. of an infeasible design) have no sun window
+    empty = TraceResult(feasible=True, timings={'geometry_seconds': 0.5})
+    traced = _result(np.ones(10))
+    combined = combine_results([empty, traced, empty])
+    assert combined.emitting_aperture == EMITTING_APERTURE
+    assert combined.number_of_rays == 10
+    assert combined.efficiency_th == traced.efficiency_th
+    assert combined.timings == {'geometry_seconds': 1.0, 'trace_seconds': traced.timings['trace_seconds']}
+
+
+def test_infeasible_parts_make_the_result_infeasible():
+    infeasible = TraceResult(feasible=False)
+    combined = combine_results([_result(np.ones(10)), infeasible])
+    assert not combined.feasible
+    assert combined.number_of_rays == 10
+
+
+def test_combining_only_empty_parts():
+    combined = combine_results([TraceResult(feasible=False), TraceResult(feasible=False)])
+    assert not combined.feasible
+    assert combined.number_of_rays == 0
+    assert combined.emitting_aperture == 0.0
+    assert combined.efficiency_th == 0.0
+    assert math.isnan(combined.efficiency_th_std_error)
+
+
+def test_as_dict_includes_efficiency():
+    result = _result(np.ones(4))
+    values = result.as_dict()
+    assert values['efficiency_th'] == result.efficiency_th
+    assert values['number_of_rays'] == 4
@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field, fields
+
+from parameters import PRIMARY_LENGTH, APERTURE_WIDTH
+
+# Settings and results of the raytrace of a design (see evaluation.trace_design),
+# without FreeCAD or otsun, so that they can be used (and tested) anywhere.
+APERTURE_AREA = PRIMARY_LENGTH * APERTURE_WIDTH  # mm2, used as the thermal aperture of the scene
+
+
+@dataclass
+class TraceSettings:
+    number_of_rays: int = 1000
+    phi: float = 0.0  # sun direction, in degrees
+    theta: float = 0.0
+    wavelength: float | str = 'ASTMG173-direct'  # fixed wavelength or name of a spectrum in otsun/data
+    csr_value: float | None = None
+    use_design_cache: bool = False  # build the design through cache.cached_design
+
+
+@dataclass
+class TraceResult:
+    feasible: bool
+    number_of_rays: int = 0
+    captured_energy_th: float = 0.0
+    captured_energy_th_sq: float = 0.0  # sum of the squares of the energy captured by each ray
+    emitting_aperture: float = 0.0  # aperture of the sun window the rays were emitted from
+    timings: dict = field(default_factory=dict)
+
+    @property
+    def efficiency_th(self) -> float:
+        # same as otsun.Experiment.efficiency_th
+        if self.number_of_rays == 0:
+            return 0.0
+        return (self.captured_energy_th / APERTURE_AREA) / (self.number_of_rays / self.emitting_aperture)
+
+    @property
+    def efficiency_th_std_error(self) -> float:
+        # efficiency_th is the mean energy captured per ray times a constant,
+        # so its standard error comes from the sample variance of those energies
+        n = self.number_of_rays
+        if n < 2:
+            return float('nan')
+        mean = self.captured_energy_th / n
+        variance = max(self.captured_energy_th_sq - n * mean ** 2, 0.0) / (n - 1)
+        return self.emitting_aperture / APERTURE_AREA * (variance / n) ** 0.5
+
+    def as_dict(self) -> dict:
+        values = {f.name: getattr(self, f.name) for f in fields(self)}
+        values['efficiency_th'] = self.efficiency_th
+        values['efficiency_th_std_error'] = self.efficiency_th_std_error
+        return values
+
+
+
+def combine_results(results: list[TraceResult]) -> TraceResult:
+    # Merges the results of independent traces of the same design (e.g. with
+    # different seeds) as if all their rays had been traced in a single run
+    timings = {}
+    for result in results:
+        for key, value in result.timings.items():
+            timings[key] = timings.get(key, 0.0) + value
+    traced = [result for result in results if result.number_of_rays > 0]
+    return TraceResult(
+        feasible=all(result.feasible for result in results),
+        number_of_rays=sum(result.number_of_rays for result in traced),
+        captured_energy_th=sum(result.captured_energy_th for result in traced),
+        captured_energy_th_sq=sum(result.captured_energy_th_sq for result in traced),
+        # the sun window only depends on the geometry, so it is the same in every trace
+        emitting_aperture=traced[0].emitting_aperture if traced else 0.0,
+        timings=timings,
+    )